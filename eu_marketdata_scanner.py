@@ -3,7 +3,7 @@
 # Output: OK / BLOCKED / UNKNOWN csv files + console summary
 #
 # Requirements:
-#   pip install ib_insync
+#   pip install ib_async
 #
 # Run:
 #   python eu_marketdata_scanner.py
@@ -12,14 +12,21 @@
 # - "OK" means we could qualify the contract AND retrieve historical bars.
 # - "BLOCKED" typically means missing market data subscription / permissions (Error 162/10089).
 # - "UNKNOWN" means contract not found (Error 200) or other issues.
+# - Qualified contracts are cached in contract_cache.json, so reruns skip
+#   qualification. Delete the file to force a full re-qualify.
 
-from ib_insync import IB, Stock
+from ib_async import IB, Stock
+import asyncio
 import datetime as dt
-import time
 import csv
+import json
+import os
 from dataclasses import dataclass
 from typing import Optional, Dict, List, Tuple
 
+from ib_budget import AsyncRateLimiter, budget_limiter
+from ib_conn import get_ib
+
 # ===============================
 # CONFIG (TWS paper)
 # ===============================
@@ -34,10 +41,15 @@ WHAT_TO_SHOW = "TRADES"
 USE_RTH = True
 
 # Timing / throttles
-QUALIFY_SLEEP = 0.15
-HIST_SLEEP = 0.35
+# API messages are paced by this client's share of the ib_budget budget.
+# Historical data is limited by IB to 60 requests per 10 minutes.
+HIST_REQS_PER_WINDOW = 60
+HIST_WINDOW_SEC = 600
 HIST_TIMEOUT_SEC = 12
-MAX_RETRIES_PER_SYMBOL = 2
+MAX_IN_FLIGHT = 8               # symbols scanned concurrently
+
+# (symbol, currency, primaryExchange) -> conId etc. from earlier runs
+CONTRACT_CACHE_FILE = "contract_cache.json"
 
 # If we see these error codes for a request, we classify as BLOCKED/UNKNOWN
 BLOCKED_CODES = {162, 10089}    # no market data permissions / needs additional subscription for API
@@ -137,7 +149,7 @@ UNIVERSE: List[Tuple[str, str, str, str]] = [
 # Data structures
 # ===============================
 
-@dataclass
+@dataclass(slots=True)
 class ScanRow:
     symbol: str
     currency: str
@@ -175,21 +187,6 @@ class ErrorTracker:
         return self.by_reqid.get(reqId, [])
 
 
-def connect_ib() -> IB:
-    ib = IB()
-    for attempt in range(1, 6):
-        try:
-            print(f"Connecting to IBKR (TWS)... attempt {attempt}")
-            ib.connect(HOST, PORT, clientId=CLIENT_ID, timeout=5)
-            if ib.isConnected():
-                print("Connected.")
-                return ib
-        except Exception as e:
-            print("Connect failed:", e)
-            time.sleep(2)
-    raise RuntimeError("Could not connect to IBKR. Is TWS running + API enabled?")
-
-
 # ===============================
 # Core scanning logic
 # ===============================
@@ -202,47 +199,121 @@ def make_contract(symbol: str, currency: str, primary_exch: str) -> Stock:
     return Stock(symbol=symbol, exchange="SMART", currency=currency, primaryExchange=primary_exch)
 
 
-def qualify_one(ib: IB, c: Stock) -> Optional[Stock]:
-    # qualifyContracts modifies contract in-place (fills conId etc)
+def dedupe_universe(universe: List[Tuple[str, str, str, str]]) -> List[Tuple[str, str, str, str]]:
+    """
+    Drop repeated (symbol, currency, primaryExchange) listings, keeping the
+    first label. Same symbol on different exchanges (e.g. SAN) is kept.
+    """
+    seen = set()
+    cleaned = []
+    for entry in universe:
+        key = entry[:3]
+        if key in seen:
+            continue
+        seen.add(key)
+        cleaned.append(entry)
+    return cleaned
+
+
+def cache_key(symbol: str, currency: str, primary_exch: str) -> str:
+    return f"{symbol}|{currency}|{primary_exch}"
+
+
+def load_contract_cache(path: str = CONTRACT_CACHE_FILE) -> Dict[str, dict]:
+    if not os.path.exists(path):
+        return {}
     try:
-        q = ib.qualifyContracts(c)
-        if not q:
-            return None
-        return q[0]
-    except Exception:
-        return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Could not read {path}: {e}")
+        return {}
+
+
+def save_contract_cache(cache: Dict[str, dict], path: str = CONTRACT_CACHE_FILE) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+
 
+def cached_contract(symbol: str, currency: str, primary_exch: str, hit: dict) -> Stock:
+    # IB resolves a contract by conId alone, so a cache hit needs no qualify.
+    return Stock(symbol=symbol, exchange="SMART", currency=currency, primaryExchange=primary_exch,
+                 conId=hit["conId"], localSymbol=hit.get("localSymbol") or "",
+                 tradingClass=hit.get("tradingClass") or "")
 
-def request_bars_with_timeout(ib: IB, contract: Stock, timeout_sec: int) -> List:
+
+async def qualify_universe(ib: IB, universe: List[Tuple[str, str, str, str]],
+                           msg_limiter: AsyncRateLimiter,
+                           cache: Dict[str, dict]) -> List[Stock]:
+    """
+    Build contracts from the cache where possible and qualify the rest in one
+    batched call. Contracts are filled in-place; the ones IB could not resolve
+    are returned with conId == 0. New qualifications are added to `cache`.
+    """
+    contracts: List[Stock] = []
+    misses: List[Tuple[str, Stock]] = []
+    for (symbol, ccy, pex, _) in universe:
+        key = cache_key(symbol, ccy, pex)
+        hit = cache.get(key)
+        if hit and hit.get("conId"):
+            contracts.append(cached_contract(symbol, ccy, pex, hit))
+        else:
+            c = make_contract(symbol, ccy, pex)
+            contracts.append(c)
+            misses.append((key, c))
+
+    print(f"Contract cache: {len(contracts) - len(misses)} hit(s), {len(misses)} to qualify")
+    if not misses:
+        return contracts
+
+    # One contract-details request per contract goes out in the batch.
+    for _ in misses:
+        await msg_limiter.acquire()
+
+    try:
+        await ib.qualifyContractsAsync(*(c for _, c in misses))
+    except Exception as e:
+        print("Batch qualify failed:", e)
+
+    for key, c in misses:
+        if c.conId:
+            cache[key] = {
+                "conId": c.conId,
+                "localSymbol": c.localSymbol,
+                "exchange": c.exchange,
+                "tradingClass": c.tradingClass,
+            }
+
+    return contracts
+
+
+async def request_bars(ib: IB, contract: Stock, timeout_sec: int) -> Tuple[List, int]:
     """
-    Request historical bars and wait up to timeout_sec.
+    Request historical bars, waiting at most timeout_sec. On timeout IB's
+    request is cancelled and no bars are returned.
+    Returns (bars, reqId) so the caller can look up errors for this exact request.
     """
-    # ib_insync is synchronous here, but can still hang on network/IB load.
-    # We'll use time-limited polling by running it in a simple pattern:
-    start = time.time()
-    bars = None
-    while True:
-        try:
-            bars = ib.reqHistoricalData(
-                contract,
-                endDateTime="",
-                durationStr=DURATION_STR,
-                barSizeSetting=BAR_SIZE,
-                whatToShow=WHAT_TO_SHOW,
-                useRTH=USE_RTH,
-                formatDate=1,
-                keepUpToDate=False
-            )
-            break
-        except Exception:
-            bars = []
-            break
-
-        if (time.time() - start) > timeout_sec:
-            bars = []
-            break
-
-    return bars or []
+    # reqHistoricalDataAsync takes the next id from client.getReqId() before its
+    # first await, so nothing else can grab it between here and the call below.
+    reqId = ib.client._reqIdSeq
+    try:
+        # IB ends the request future on either the last bar or a terminal error
+        # for reqId; the error has already been emitted when the await returns.
+        bars = await ib.reqHistoricalDataAsync(
+            contract,
+            endDateTime="",
+            durationStr=DURATION_STR,
+            barSizeSetting=BAR_SIZE,
+            whatToShow=WHAT_TO_SHOW,
+            useRTH=USE_RTH,
+            formatDate=1,
+            keepUpToDate=False,
+            timeout=timeout_sec
+        )
+    except Exception:
+        bars = []
+
+    return bars or [], reqId
 
 
 def classify_from_errors(errors: List[Tuple[int, str]]) -> Tuple[str, str]:
@@ -252,93 +323,60 @@ def classify_from_errors(errors: List[Tuple[int, str]]) -> Tuple[str, str]:
     if not errors:
         return ("OK", "bars_ok")
 
-    codes = {c for (c, _) in errors}
-
-    if codes & BLOCKED_CODES:
-        # pick the first matching code
-        for c, msg in errors:
-            if c in BLOCKED_CODES:
-                return ("BLOCKED", f"err{c}:{msg[:160]}")
-        return ("BLOCKED", "blocked")
+    # Single pass: BLOCKED wins outright, otherwise the first UNKNOWN,
+    # otherwise the first error of any other kind.
+    unknown = None
+    for c, msg in errors:
+        if c in BLOCKED_CODES:
+            return ("BLOCKED", f"err{c}:{msg[:160]}")
+        if unknown is None and c in UNKNOWN_CODES:
+            unknown = (c, msg)
 
-    if codes & UNKNOWN_CODES:
-        for c, msg in errors:
-            if c in UNKNOWN_CODES:
-                return ("UNKNOWN", f"err{c}:{msg[:160]}")
-        return ("UNKNOWN", "unknown_contract")
+    if unknown:
+        c, msg = unknown
+        return ("UNKNOWN", f"err{c}:{msg[:160]}")
 
     # other errors => ERROR
     c, msg = errors[0]
     return ("ERROR", f"err{c}:{msg[:160]}")
 
 
-def scan_universe(ib: IB, universe: List[Tuple[str, str, str, str]]) -> List[ScanRow]:
-    tracker = ErrorTracker()
-    ib.errorEvent += tracker.on_error
-
-    results: List[ScanRow] = []
+async def scan_one(ib: IB, tracker: ErrorTracker, sem: asyncio.Semaphore,
+                   msg_limiter: AsyncRateLimiter, hist_limiter: AsyncRateLimiter,
+                   idx: int, total: int, entry: Tuple[str, str, str, str],
+                   qualified: Stock) -> ScanRow:
+    symbol, ccy, pex, name = entry
+    tag = f"[{idx:03d}/{total}] {symbol} {ccy} (primary={pex})"
 
-    print(f"Scanning {len(universe)} EU/Nordic/UK symbols for historical data permissions...")
-    print(f"Hist settings: duration={DURATION_STR}, barsize={BAR_SIZE}, RTH={USE_RTH}, what={WHAT_TO_SHOW}")
-    print("-" * 80)
-
-    for idx, (symbol, ccy, pex, name) in enumerate(universe, start=1):
+    async with sem:
         row = ScanRow(symbol=symbol, currency=ccy, primaryExchange=pex, name=name,
                       status="UNKNOWN", reason="not_scanned")
 
-        print(f"[{idx:03d}/{len(universe)}] {symbol} {ccy} (primary={pex}) ...", end=" ")
-
-        contract = make_contract(symbol, ccy, pex)
-
-        qualified = None
-        for attempt in range(1, MAX_RETRIES_PER_SYMBOL + 1):
-            qualified = qualify_one(ib, contract)
-            if qualified and getattr(qualified, "conId", 0):
-                break
-            time.sleep(0.15)
-
-        if not qualified:
+        if not qualified.conId:
             row.status = "UNKNOWN"
             row.reason = "qualify_failed"
-            print("UNKNOWN (qualify_failed)")
-            results.append(row)
-            time.sleep(QUALIFY_SLEEP)
-            continue
+            print(f"{tag} ... UNKNOWN (qualify_failed)")
+            return row
 
         # Fill details
-        row.conId = getattr(qualified, "conId", None)
-        row.localSymbol = getattr(qualified, "localSymbol", None)
-        row.exchange = getattr(qualified, "exchange", None)
-        row.tradingClass = getattr(qualified, "tradingClass", None)
-
-        time.sleep(QUALIFY_SLEEP)
-
-        # Request bars. Errors for historical data often come with reqId,
-        # but ib_insync doesn't expose reqId directly here.
-        # We'll still classify by whether bars came back + if any recent error fired.
-        # To make this deterministic, we clear "most recent errors" before request and
-        # then inspect tracker for ANY new errors within a short window.
-        before_snapshot = dict(tracker.by_reqid)
-
-        bars = request_bars_with_timeout(ib, qualified, HIST_TIMEOUT_SEC)
-        time.sleep(0.25)  # allow error events to arrive
-
-        # Collect new errors since snapshot
-        new_errors: List[Tuple[int, str]] = []
-        for reqId, errs in tracker.by_reqid.items():
-            if reqId not in before_snapshot:
-                new_errors.extend(errs)
-            else:
-                # reqId existed before; include only newly appended errors
-                old = before_snapshot[reqId]
-                if len(errs) > len(old):
-                    new_errors.extend(errs[len(old):])
+        row.conId = qualified.conId
+        row.localSymbol = qualified.localSymbol
+        row.exchange = qualified.exchange
+        row.tradingClass = qualified.tradingClass
+
+        await hist_limiter.acquire()
+        await msg_limiter.acquire()
+
+        # Request bars. Errors are routed by the reqId of this request, so
+        # other symbols in flight can't leak into the classification.
+        bars, reqId = await request_bars(ib, qualified, HIST_TIMEOUT_SEC)
+        new_errors = tracker.pop(reqId)
 
         # If bars exist, we accept OK even if there are harmless warnings.
         if bars:
             row.status = "OK"
             row.reason = f"bars_ok(n={len(bars)})"
-            print(f"OK (bars={len(bars)})")
+            print(f"{tag} ... OK (bars={len(bars)})")
         else:
             status, reason = classify_from_errors(new_errors)
             # If we got no bars and no useful error, treat as ERROR timeout/no_data
@@ -347,13 +385,43 @@ def scan_universe(ib: IB, universe: List[Tuple[str, str, str, str]]) -> List[Sca
                 reason = "no_bars_no_error(timeout_or_no_data)"
             row.status = status
             row.reason = reason
-            print(f"{row.status} ({row.reason})")
+            print(f"{tag} ... {row.status} ({row.reason})")
 
-        results.append(row)
-        time.sleep(HIST_SLEEP)
+        return row
 
-    ib.errorEvent -= tracker.on_error
-    return results
+
+async def scan_universe(ib: IB, universe: List[Tuple[str, str, str, str]],
+                        cache: Optional[Dict[str, dict]] = None) -> List[ScanRow]:
+    deduped = dedupe_universe(universe)
+    if len(deduped) < len(universe):
+        print(f"Dropped {len(universe) - len(deduped)} duplicate listing(s) from universe")
+    universe = deduped
+
+    tracker = ErrorTracker()
+    ib.errorEvent += tracker.on_error
+
+    print(f"Scanning {len(universe)} EU/Nordic/UK symbols for historical data permissions...")
+    print(f"Hist settings: duration={DURATION_STR}, barsize={BAR_SIZE}, RTH={USE_RTH}, what={WHAT_TO_SHOW}")
+    print(f"Concurrency: {MAX_IN_FLIGHT} symbols in flight")
+    print("-" * 80)
+
+    # One coroutine per symbol; the semaphore bounds how many talk to IB at once.
+    # gather() keeps results in universe order.
+    sem = asyncio.Semaphore(MAX_IN_FLIGHT)
+    msg_limiter = budget_limiter(CLIENT_ID)
+    hist_limiter = AsyncRateLimiter(HIST_REQS_PER_WINDOW, per=HIST_WINDOW_SEC)
+    try:
+        contracts = await qualify_universe(ib, universe, msg_limiter, {} if cache is None else cache)
+        print(f"Qualified {sum(1 for c in contracts if c.conId)}/{len(contracts)} contracts")
+
+        results = await asyncio.gather(*(
+            scan_one(ib, tracker, sem, msg_limiter, hist_limiter, idx, len(universe), entry, contract)
+            for idx, (entry, contract) in enumerate(zip(universe, contracts), start=1)
+        ))
+    finally:
+        ib.errorEvent -= tracker.on_error
+
+    return list(results)
 
 
 def write_csv(path: str, rows: List[ScanRow]) -> None:
@@ -364,17 +432,18 @@ def write_csv(path: str, rows: List[ScanRow]) -> None:
             "status", "reason",
             "conId", "localSymbol", "exchange", "tradingClass"
         ])
-        for r in rows:
-            w.writerow([
-                r.symbol, r.currency, r.primaryExchange, r.name,
-                r.status, r.reason,
-                r.conId or "", r.localSymbol or "", r.exchange or "", r.tradingClass or ""
-            ])
+        w.writerows([
+            (r.symbol, r.currency, r.primaryExchange, r.name,
+             r.status, r.reason,
+             r.conId or "", r.localSymbol or "", r.exchange or "", r.tradingClass or "")
+            for r in rows
+        ])
 
 
 def main():
     ts = dt.datetime.now().strftime("%Y%m%d_%H%M%S")
-    ib = connect_ib()
+    ib = get_ib(CLIENT_ID, HOST, PORT)
+    print("Connected.")
 
     # Print account (optional)
     try:
@@ -385,12 +454,18 @@ def main():
         pass
 
     print("\nEU MARKETDATA SCANNER STARTED\n")
-    results = scan_universe(ib, UNIVERSE)
-
-    ok = [r for r in results if r.status == "OK"]
-    blocked = [r for r in results if r.status == "BLOCKED"]
-    unknown = [r for r in results if r.status == "UNKNOWN"]
-    error = [r for r in results if r.status == "ERROR"]
+    cache = load_contract_cache()
+    results = ib.run(scan_universe(ib, UNIVERSE, cache))
+    save_contract_cache(cache)
+
+    # One pass over results into per-status buckets
+    buckets: Dict[str, List[ScanRow]] = {"OK": [], "BLOCKED": [], "UNKNOWN": [], "ERROR": []}
+    for r in results:
+        buckets[r.status].append(r)
+    ok = buckets["OK"]
+    blocked = buckets["BLOCKED"]
+    unknown = buckets["UNKNOWN"]
+    error = buckets["ERROR"]
 
     ok_path = f"eu_scan_ok_{ts}.csv"
     blocked_path = f"eu_scan_blocked_{ts}.csv"
@@ -416,7 +491,6 @@ def main():
         for r in ok[:10]:
             print(f"  {r.symbol:10s} {r.currency:3s} primary={r.primaryExchange:5s} conId={r.conId} local={r.localSymbol} exch={r.exchange}")
 
-    ib.disconnect()
     print("\nDONE")
 
 
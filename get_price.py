@@ -1,7 +1,8 @@
-from ib_insync import IB, Stock
+from ib_async import Stock
 
-ib = IB()
-ib.connect("127.0.0.1", 7497, clientId=2)
+from ib_conn import get_ib
+
+ib = get_ib(2)
 
 # 1=live, 2=frozen, 3=delayed, 4=delayed frozen
 ib.reqMarketDataType(3)
@@ -15,5 +16,3 @@ ib.sleep(2)
 print("SPY last:", ticker.last)
 print("SPY bid:", ticker.bid)
 print("SPY ask:", ticker.ask)
-
-ib.disconnect()
@@ -1,7 +1,8 @@
-from ib_insync import IB, Stock
+from ib_async import Stock
 
-ib = IB()
-ib.connect("127.0.0.1", 7497, clientId=3)
+from ib_conn import get_ib
+
+ib = get_ib(3)
 
 ib.reqMarketDataType(3)  # 3 = delayed
 
@@ -16,5 +17,3 @@ print("SPY last:", ticker.last)
 print("SPY close:", ticker.close)
 print("SPY bid:", ticker.bid)
 print("SPY ask:", ticker.ask)
-
-ib.disconnect()
@@ -1,8 +1,9 @@
-from ib_insync import IB, Stock, util
+from ib_async import Stock, util
 import pandas as pd
 
-ib = IB()
-ib.connect("127.0.0.1", 7497, clientId=20)
+from ib_conn import get_ib
+
+ib = get_ib(20)
 
 contract = Stock("SPY", "SMART", "USD")
 ib.qualifyContracts(contract)
@@ -18,5 +19,3 @@ bars = ib.reqHistoricalData(
 
 df = util.df(bars)
 print(df.tail())
-
-ib.disconnect()
@@ -0,0 +1,99 @@
+# ib_budget.py
+# Shared API pacing budget for scripts that run against one TWS/Gateway.
+#
+# IB disconnects a client that sends more than 50 messages/sec. We plan for
+# 40 msg/s and keep 10 msg/s of headroom for background traffic (tick and
+# order-status messages). The 40 are split between the scripts that can run
+# at the same time under a supervisor, per CLIENT_ID, so they can't starve
+# each other or push TWS over the limit at the market-open peak:
+#
+#   CLIENT_ID  script                     share   msg/s
+#   2          paper_trader_eu.py         0.30    12
+#   1          paper_trader_us.py         0.15     6
+#   55         paper_trader.py            0.15     6
+#   7          eu_marketdata_scanner.py   0.20     8
+#   40         multi_signal.py            0.10     4
+#   (other)    DEFAULT_SHARE              0.10     4
+#
+# Any other client id gets DEFAULT_SHARE; run at most one such script at a
+# time. Give a new long-running script its own row and keep the listed shares
+# plus DEFAULT_SHARE summing to <= 1.0.
+
+import asyncio
+import time
+from typing import Dict
+
+MSG_BUDGET_PER_SEC = 40
+REQUEST_TIMEOUT = 30        # seconds; applied to every IB() at connect time
+
+CLIENT_SHARES: Dict[int, float] = {
+    2: 0.30,
+    1: 0.15,
+    55: 0.15,
+    7: 0.20,
+    40: 0.10,
+}
+DEFAULT_SHARE = 0.10
+
+
+class AsyncRateLimiter:
+    """
+    Token bucket for asyncio: at most `rate` acquisitions per `per` seconds,
+    with bursts up to `rate`. Waiters are served in order.
+    """
+    def __init__(self, rate: float, per: float = 1.0):
+        self.rate = rate
+        self.per = per
+        self._tokens = float(rate)
+        self._last = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                refill = (now - self._last) * self.rate / self.per
+                self._tokens = min(float(self.rate), self._tokens + refill)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) * self.per / self.rate)
+
+
+_LIMITERS: Dict[int, AsyncRateLimiter] = {}
+
+
+def budget_limiter(client_id: int) -> AsyncRateLimiter:
+    """
+    The process-wide message limiter for client_id, sized to its share
+    of MSG_BUDGET_PER_SEC.
+    """
+    limiter = _LIMITERS.get(client_id)
+    if limiter is None:
+        share = CLIENT_SHARES.get(client_id, DEFAULT_SHARE)
+        limiter = AsyncRateLimiter(MSG_BUDGET_PER_SEC * share, per=1.0)
+        _LIMITERS[client_id] = limiter
+    return limiter
+
+
+async def fetch_bars(ib, contracts: list, client_id: int, duration: str,
+                     bar_size: str, use_rth: bool = True) -> list:
+    """
+    Historical TRADES bars for every contract, sent as fast as client_id's
+    message budget allows. gather returns them in contract order.
+    """
+    limiter = budget_limiter(client_id)
+
+    async def fetch(c):
+        await limiter.acquire()
+        return await ib.reqHistoricalDataAsync(
+            c,
+            endDateTime="",
+            durationStr=duration,
+            barSizeSetting=bar_size,
+            whatToShow="TRADES",
+            useRTH=use_rth
+        )
+
+    return await asyncio.gather(*(fetch(c) for c in contracts))
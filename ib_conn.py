@@ -0,0 +1,52 @@
+# ib_conn.py
+# Shared IB connection cache.
+#
+# Scripts call get_ib(CLIENT_ID) instead of IB() + connect(). The first call in
+# a process does the TWS handshake; later calls with the same
+# (host, port, client_id) reuse that connection, reconnecting it first if it
+# has dropped. Connecting retries with exponential backoff, so scripts don't
+# need their own retry loops. Every cached connection is disconnected once,
+# at interpreter exit.
+
+import atexit
+import time
+from typing import Dict, Tuple
+
+from ib_async import IB
+
+from ib_budget import REQUEST_TIMEOUT
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 7497          # TWS paper default
+
+# TWS/Gateway runs on loopback: it answers at once or is down, so fail fast
+# (~16.5s worst case). Raise the timeout only for a remote/WAN gateway.
+CONNECT_TIMEOUT = 5
+CONNECT_ATTEMPTS = 3
+CONNECT_BACKOFF = 0.5        # sleeps 0.5s, 1s between attempts
+
+_CONNECTIONS: Dict[Tuple[str, int, int], IB] = {}
+
+
+def get_ib(client_id: int, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+           timeout: float = CONNECT_TIMEOUT) -> IB:
+    key = (host, port, client_id)
+    ib = _CONNECTIONS.get(key)
+    if ib is not None and ib.isConnected():
+        return ib
+
+    if ib is None:
+        ib = IB()
+        ib.RequestTimeout = REQUEST_TIMEOUT
+        _CONNECTIONS[key] = ib
+        atexit.register(ib.disconnect)
+
+    for attempt in range(CONNECT_ATTEMPTS):
+        try:
+            ib.connect(host, port, clientId=client_id, timeout=timeout)
+            return ib
+        except Exception as e:
+            print(f"CONNECT attempt {attempt + 1} failed: {e}")
+            if attempt + 1 == CONNECT_ATTEMPTS:
+                raise
+            time.sleep(CONNECT_BACKOFF * 2 ** attempt)
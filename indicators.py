@@ -0,0 +1,42 @@
+# indicators.py
+# Last-value indicator helpers on NumPy arrays.
+#
+# The signal scripts only look at the most recent bar, so these return a
+# single float instead of building full pandas indicator columns.
+# Values match the pandas formulas they replace:
+#   ema_last(x, n) == x.ewm(span=n).mean().iloc[-1]
+#   sma_last(x, n) == x.rolling(n).mean().iloc[-1]
+#   rsi_last(x, n) == the rolling-mean RSI used in paper_trader.py
+
+import numpy as np
+
+
+def bar_array(bars, field: str = "close") -> np.ndarray:
+    # One float64 array straight from BarData objects, no DataFrame in between
+    return np.fromiter((getattr(b, field) for b in bars), dtype=np.float64, count=len(bars))
+
+
+def ema_last(values: np.ndarray, span: int) -> float:
+    # pandas ewm(adjust=True): weighted mean with weights (1-alpha)^age
+    alpha = 2.0 / (span + 1)
+    weights = (1.0 - alpha) ** np.arange(len(values) - 1, -1, -1, dtype=np.float64)
+    return float(np.dot(weights, values) / weights.sum())
+
+
+def sma_last(values: np.ndarray, length: int) -> float:
+    if len(values) < length:
+        return float("nan")
+    return float(values[-length:].mean())
+
+
+def rsi_last(values: np.ndarray, period: int = 14) -> float:
+    if len(values) < period + 1:
+        return float("nan")
+    delta = np.diff(values[-(period + 1):])
+    gain = delta.clip(min=0).mean()
+    loss = (-delta).clip(min=0).mean()
+    if loss == 0:
+        # pandas gives rs=inf -> 100, or 0/0 -> nan
+        return 100.0 if gain > 0 else float("nan")
+    rs = gain / loss
+    return float(100 - (100 / (1 + rs)))
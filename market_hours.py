@@ -0,0 +1,40 @@
+# market_hours.py
+# Cheap "is the session open?" check shared by the traders.
+#
+# Today's open/close are computed once as UTC epoch seconds and kept in a
+# caller-owned cache dict until the next local midnight, so the per-loop
+# check is two float compares with no time-zone conversion. Session times
+# are local wall-clock times in `tz`, so DST is handled by zoneinfo.
+
+import datetime as dt
+import time
+from typing import Dict
+
+
+def new_session_cache() -> Dict[str, float]:
+    return {"open": 0.0, "close": 0.0, "valid_until": 0.0}
+
+
+def _refresh(tz: dt.tzinfo, open_time: dt.time, close_time: dt.time,
+             cache: Dict[str, float]) -> None:
+    now = dt.datetime.now(tz)
+    today = now.date()
+    midnight = dt.datetime.combine(today + dt.timedelta(days=1), dt.time(0), tz)
+    if now.weekday() >= 5:
+        open_ts = close_ts = 0.0
+    else:
+        open_ts = dt.datetime.combine(today, open_time, tz).timestamp()
+        close_ts = dt.datetime.combine(today, close_time, tz).timestamp()
+    cache.update(open=open_ts, close=close_ts, valid_until=midnight.timestamp())
+
+
+def session_open_now(tz: dt.tzinfo, open_time: dt.time, close_time: dt.time,
+                     cache: Dict[str, float]) -> bool:
+    """
+    True on weekdays between open_time and close_time local to tz.
+    cache comes from new_session_cache(); use one per market.
+    """
+    now = time.time()
+    if now >= cache["valid_until"]:
+        _refresh(tz, open_time, close_time, cache)
+    return cache["open"] <= now < cache["close"]
@@ -1,52 +1,46 @@
-from ib_insync import IB, Stock, util
+from ib_async import Stock
 import pandas as pd
 
+from ib_budget import fetch_bars
+from ib_conn import get_ib
+from indicators import bar_array, ema_last, sma_last
+
 TICKERS = ["SPY", "QQQ", "AAPL", "NVDA", "TSLA"]
 HOST, PORT = "127.0.0.1", 7497
+CLIENT_ID = 40
 
-def get_signal(df: pd.DataFrame):
-    df = df.copy()
-    df["EMA20"] = df["close"].ewm(span=20).mean()
-    df["VolAvg20"] = df["volume"].rolling(20).mean()
+def get_signal(bars):
+    closes = bar_array(bars, "close")
+    volumes = bar_array(bars, "volume")
 
-    latest = df.iloc[-1]
-    prev = df.iloc[-2]
+    close, prev_close = closes[-1], closes[-2]
+    volume = volumes[-1]
+    ema20 = ema_last(closes, 20)
+    vol_avg20 = sma_last(volumes, 20)
 
-    cond_ema = latest.close > latest.EMA20
-    cond_momo = latest.close > prev.close
-    cond_vol = latest.volume > latest.VolAvg20
+    cond_ema = close > ema20
+    cond_momo = close > prev_close
+    cond_vol = volume > vol_avg20
 
     signal = bool(cond_ema and cond_momo and cond_vol)
-    return signal, float(latest.close), float(latest.EMA20), float(latest.volume), float(latest.VolAvg20)
+    return signal, float(close), ema20, float(volume), vol_avg20
 
 def main():
-    ib = IB()
-    ib.connect(HOST, PORT, clientId=40)
+    ib = get_ib(CLIENT_ID, HOST, PORT)
+
+    contracts = [Stock(sym, "SMART", "USD") for sym in TICKERS]
+    ib.qualifyContracts(*contracts)
+    all_bars = ib.run(fetch_bars(ib, contracts, CLIENT_ID, "2 D", "5 mins"))
 
     results = []
-    for sym in TICKERS:
-        c = Stock(sym, "SMART", "USD")
-        ib.qualifyContracts(c)
-
-        bars = ib.reqHistoricalData(
-            c,
-            endDateTime="",
-            durationStr="2 D",
-            barSizeSetting="5 mins",
-            whatToShow="TRADES",
-            useRTH=True
-        )
-        df = util.df(bars)
-
-        if len(df) < 25:
+    for sym, bars in zip(TICKERS, all_bars):
+        if len(bars) < 25:
             results.append((sym, "NO_DATA", None, None, None, None))
             continue
 
-        signal, close, ema20, vol, volavg = get_signal(df)
+        signal, close, ema20, vol, volavg = get_signal(bars)
         results.append((sym, signal, close, ema20, vol, volavg))
 
-    ib.disconnect()
-
     out = pd.DataFrame(results, columns=["symbol", "buy_signal", "close", "ema20", "volume", "volAvg20"])
     print(out.to_string(index=False))
 
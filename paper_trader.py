@@ -5,9 +5,12 @@ import os
 import csv
 import json
 import math
-import time
 
-from ib_insync import IB, Stock, util, MarketOrder, LimitOrder, StopOrder
+from ib_async import IB, Stock, MarketOrder, LimitOrder, StopOrder
+
+from ib_budget import fetch_bars
+from ib_conn import get_ib
+from indicators import bar_array, ema_last, rsi_last
 
 
 # ========= CONFIG =========
@@ -28,8 +31,13 @@ TICKERS = [
 
 ACCOUNT_EQUITY_DKK = 5000.0
 RISK_PER_TRADE_PCT = 0.01
-STOP_LOSS_PCT = 0.007
-TAKE_PROFIT_PCT = 0.012
+
+# Bracket distances in basis points (1 bp = 0.01 %)
+BP_PER_UNIT = 10000
+STOP_LOSS_BP = 70
+TAKE_PROFIT_BP = 120
+STOP_LOSS_PCT = STOP_LOSS_BP / BP_PER_UNIT
+TAKE_PROFIT_PCT = TAKE_PROFIT_BP / BP_PER_UNIT
 
 MAX_TRADES_PER_DAY = 2
 
@@ -56,17 +64,35 @@ def today_utc_str() -> str:
     return str(utc_now().date())
 
 def ensure_csv_header(path: str, header: list[str]) -> None:
-    if not os.path.exists(path) or os.path.getsize(path) == 0:
-        with open(path, "w", newline="", encoding="utf-8") as f:
+    # One open() creates the file if needed; an empty file gets the header
+    with open(path, "a+", newline="", encoding="utf-8") as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() == 0:
             csv.writer(f).writerow(header)
 
 def append_csv(path: str, row: list) -> None:
     with open(path, "a", newline="", encoding="utf-8") as f:
         csv.writer(f).writerow(row)
 
+def parse_utc_iso(s) -> datetime | None:
+    if not s:
+        return None
+    try:
+        t = datetime.fromisoformat(s)
+    except Exception:
+        return None
+    return t.astimezone(timezone.utc) if t.tzinfo else t.replace(tzinfo=timezone.utc)
+
+def cache_state_times(state: dict) -> dict:
+    # Parsed once per load; "_" keys are runtime-only and never written to disk
+    open_pos = state.get("open_position") or {}
+    state["_entry_time_dt"] = parse_utc_iso(open_pos.get("entry_time"))
+    state["_last_close_time_dt"] = parse_utc_iso(state.get("last_close_time"))
+    return state
+
 def read_state() -> dict:
     if not os.path.exists(STATE_FILE):
-        return {"date": today_utc_str(), "trades_today": 0, "open_position": None, "last_close_time": None}
+        return cache_state_times({"date": today_utc_str(), "trades_today": 0, "open_position": None, "last_close_time": None})
     try:
         with open(STATE_FILE, "r", encoding="utf-8") as f:
             state = json.load(f)
@@ -74,13 +100,13 @@ def read_state() -> dict:
         state.setdefault("trades_today", 0)
         state.setdefault("open_position", None)
         state.setdefault("last_close_time", None)
-        return state
+        return cache_state_times(state)
     except Exception:
-        return {"date": today_utc_str(), "trades_today": 0, "open_position": None, "last_close_time": None}
+        return cache_state_times({"date": today_utc_str(), "trades_today": 0, "open_position": None, "last_close_time": None})
 
 def write_state(state: dict) -> None:
     with open(STATE_FILE, "w", encoding="utf-8") as f:
-        json.dump(state, f, indent=2)
+        json.dump({k: v for k, v in state.items() if not k.startswith("_")}, f, indent=2)
 
 def reset_state_if_new_day(state: dict) -> dict:
     if state.get("date") != today_utc_str():
@@ -92,33 +118,22 @@ def reset_state_if_new_day(state: dict) -> dict:
 def pick_price(ticker_obj):
     last = ticker_obj.last
     close = ticker_obj.close
-    if last is not None and last == last and last > 0:
+    if last is not None and math.isfinite(last) and last > 0:
         return float(last), "last"
-    if close is not None and close == close and close == close and close > 0:
+    if close is not None and math.isfinite(close) and close > 0:
         return float(close), "close"
     return None, "none"
 
 
 # ========= SIGNAL =========
-def rsi(series, period=14):
-    delta = series.diff()
-    gain = delta.clip(lower=0).rolling(period).mean()
-    loss = (-delta.clip(upper=0)).rolling(period).mean()
-    rs = gain / loss
-    return 100 - (100 / (1 + rs))
-
-def get_signal(df):
-    df = df.copy()
-    df["EMA20"] = df["close"].ewm(span=20).mean()
-    df["EMA50"] = df["close"].ewm(span=50).mean()
-    df["RSI14"] = rsi(df["close"], 14)
-
-    if len(df) < 60:
+def get_signal(bars):
+    if len(bars) < 60:
         return False
 
-    latest = df.iloc[-1]
-    cond_trend = latest.close > latest.EMA20 and latest.close > latest.EMA50
-    cond_rsi = latest.RSI14 > 55
+    closes = bar_array(bars, "close")
+    last = closes[-1]
+    cond_trend = last > ema_last(closes, 20) and last > ema_last(closes, 50)
+    cond_rsi = rsi_last(closes, 14) > 55
     return bool(cond_trend and cond_rsi)
 
 
@@ -133,15 +148,19 @@ def calc_qty(price: float) -> int:
 
 
 # ========= ORDERS =========
+def bp_offset_price(price_cents: int, bp: int) -> float:
+    # Exact integer cents (round half up), so IB never sees 123.456000000001
+    cents = (price_cents * (BP_PER_UNIT + bp) + BP_PER_UNIT // 2) // BP_PER_UNIT
+    return cents / 100
+
 def place_bracket(ib: IB, contract, qty: int, entry_ref_price: float):
-    tp_price = round(entry_ref_price * (1 + TAKE_PROFIT_PCT), 2)
-    sl_price = round(entry_ref_price * (1 - STOP_LOSS_PCT), 2)
+    entry_cents = round(entry_ref_price * 100)
+    tp_price = bp_offset_price(entry_cents, TAKE_PROFIT_BP)
+    sl_price = bp_offset_price(entry_cents, -STOP_LOSS_BP)
 
     parent = MarketOrder("BUY", qty)
     parent.transmit = False
     parent_trade = ib.placeOrder(contract, parent)
-    ib.sleep(0.5)
-
     parent_id = parent_trade.order.orderId
 
     take_profit = LimitOrder("SELL", qty, tp_price)
@@ -165,14 +184,6 @@ def place_bracket(ib: IB, contract, qty: int, entry_ref_price: float):
 
 
 # ========= CLOSE LOGIC =========
-def parse_ib_time(t) -> datetime | None:
-    try:
-        if isinstance(t, datetime):
-            return t.astimezone(timezone.utc) if t.tzinfo else t.replace(tzinfo=timezone.utc)
-        return datetime.fromisoformat(str(t)).astimezone(timezone.utc)
-    except Exception:
-        return None
-
 def check_and_log_close(ib: IB, state: dict) -> dict:
     open_pos = state.get("open_position")
     if not open_pos:
@@ -186,54 +197,29 @@ def check_and_log_close(ib: IB, state: dict) -> dict:
     qty = int(open_pos.get("qty", 0))
     entry_price = float(open_pos.get("entry_price", 0.0))
 
-    entry_time = None
-    try:
-        entry_time = datetime.fromisoformat(open_pos.get("entry_time"))
-        if entry_time.tzinfo is None:
-            entry_time = entry_time.replace(tzinfo=timezone.utc)
-        else:
-            entry_time = entry_time.astimezone(timezone.utc)
-    except Exception:
-        entry_time = None
-
-    last_close_time = None
-    if state.get("last_close_time"):
-        try:
-            last_close_time = datetime.fromisoformat(state["last_close_time"])
-            if last_close_time.tzinfo is None:
-                last_close_time = last_close_time.replace(tzinfo=timezone.utc)
-            else:
-                last_close_time = last_close_time.astimezone(timezone.utc)
-        except Exception:
-            last_close_time = None
-
-    execs = ib.executions()
+    # Only a sell after both the entry and the previously logged close counts
+    cutoffs = [t for t in (state.get("_entry_time_dt"), state.get("_last_close_time_dt")) if t]
+    cutoff = max(cutoffs) if cutoffs else None
+
+    # Fills carry the contract and a UTC datetime, and arrive in chronological
+    # order: walk newest-first and stop at the first sell for this symbol.
     best = None
     best_time = None
 
-    for e in execs:
-        if getattr(e, "side", None) != "SLD":
-            continue
-        if getattr(e.contract, "symbol", None) != symbol:
-            continue
-
-        et = parse_ib_time(e.time)
-        if et is None:
+    for f in reversed(ib.fills()):
+        if f.execution.side != "SLD" or f.contract.symbol != symbol:
             continue
-        if entry_time and et <= entry_time:
-            continue
-        if last_close_time and et <= last_close_time:
-            continue
-
-        if best is None or et > best_time:
-            best = e
-            best_time = et
+        if cutoff is None or f.time > cutoff:
+            best = f.execution
+            best_time = f.time
+        break
 
     # Hvis vi ikke kan finde SELL execution (fx fordi ordren blev cancelled uden fill),
     # så nulstiller vi state alligevel, fordi der ikke er positioner/ordrer i IB.
     if best is None:
         print("\n=== POSITION CLEARED (no open pos/orders, no sell execution found) ===")
         state["open_position"] = None
+        state["_entry_time_dt"] = None
         write_state(state)
         return state
 
@@ -257,6 +243,8 @@ def check_and_log_close(ib: IB, state: dict) -> dict:
 
     state["open_position"] = None
     state["last_close_time"] = best_time.isoformat()
+    state["_entry_time_dt"] = None
+    state["_last_close_time_dt"] = best_time
     write_state(state)
     return state
 
@@ -274,24 +262,11 @@ def main():
     state = reset_state_if_new_day(read_state())
 
     # --- Robust connect (timeout + retries) ---
-    ib = IB()
-    ib.RequestTimeout = 30
-
-    connected = False
-    for attempt in range(1, 4):
-        try:
-            ib.connect(HOST, PORT, clientId=CLIENT_ID, timeout=30)
-            connected = True
-            break
-        except Exception as e:
-            print(f"CONNECT attempt {attempt} failed: {e}")
-            try:
-                ib.disconnect()
-            except Exception:
-                pass
-            time.sleep(3)
-
-    if not connected:
+    # get_ib() retries with backoff, reuses the process-wide connection and
+    # disconnects it at exit.
+    try:
+        ib = get_ib(CLIENT_ID, HOST, PORT)
+    except Exception:
         print("STOP: Could not connect to IB Gateway/TWS. Restart Gateway and ensure it is fully logged in.")
         return
 
@@ -306,35 +281,25 @@ def main():
 
     if open_orders:
         print("STOP: There are open orders already. Not placing new trades.")
-        ib.disconnect()
         return
 
     if positions:
         print("STOP: There is an open position already. Not placing new trades.")
-        ib.disconnect()
         return
 
     # 3) Daily limit
     if int(state.get("trades_today", 0)) >= MAX_TRADES_PER_DAY:
         print("STOP: Max trades reached today.")
-        ib.disconnect()
         return
 
     # 4) Scan + place første trade
-    for sym in TICKERS:
-        contract = Stock(sym, "SMART", "USD")
-        ib.qualifyContracts(contract)
-
-        bars = ib.reqHistoricalData(
-            contract,
-            endDateTime="",
-            durationStr=BAR_DURATION,
-            barSizeSetting=BAR_SIZE,
-            whatToShow="TRADES",
-            useRTH=USE_RTH
-        )
-        df = util.df(bars)
-        signal = get_signal(df)
+    # Qualify and fetch bars for every ticker in one concurrent burst
+    contracts = [Stock(sym, "SMART", "USD") for sym in TICKERS]
+    ib.qualifyContracts(*contracts)
+    all_bars = ib.run(fetch_bars(ib, contracts, CLIENT_ID, BAR_DURATION, BAR_SIZE, USE_RTH))
+
+    for sym, contract, bars in zip(TICKERS, contracts, all_bars):
+        signal = get_signal(bars)
 
         t = ib.reqMktData(contract, snapshot=True)
         ib.sleep(1.2)
@@ -357,7 +322,6 @@ def main():
         if not parent_trade.fills:
             print("Order not filled. Skipping state update.")
             # ryd evt. hængende child orders hvis de blev lagt (sjældent ved cancelled parent)
-            ib.disconnect()
             print("\nDONE")
             return
 
@@ -376,19 +340,20 @@ def main():
             utc_now_iso(), sym, qty, entry_price, source, tp_price, sl_price, order_id
         ])
 
+        entry_time = utc_now()
         state["open_position"] = {
             "symbol": sym,
             "qty": qty,
             "entry_price": entry_price,
-            "entry_time": utc_now_iso(),
+            "entry_time": entry_time.isoformat(),
             "order_id": order_id
         }
+        state["_entry_time_dt"] = entry_time
         state["trades_today"] = int(state.get("trades_today", 0)) + 1
         write_state(state)
 
         break
 
-    ib.disconnect()
     print("\nDONE")
 
 
@@ -1,12 +1,18 @@
-from ib_insync import *
+from ib_async import *
+import asyncio
+import heapq
 import time
 import datetime as dt
-import os
 import glob
-import csv
+import pandas as pd
 from decimal import Decimal, ROUND_HALF_UP
 from zoneinfo import ZoneInfo
 
+from ib_budget import budget_limiter
+from ib_conn import get_ib
+from market_hours import new_session_cache, session_open_now
+from indicators import bar_array, sma_last
+
 # ===============================
 # CONFIG
 # ===============================
@@ -19,9 +25,13 @@ CAPITAL_PER_TRADE_EUR = 25000
 MAX_OPEN_POSITIONS = 35
 LOOP_SECONDS = 15
 
+# NB: ATR_LEN, MIN_SCORE, TAKE_PROFIT_ATR and STOP_LOSS_ATR are bound as default
+# args of the scoring/ATR/bracket functions at import; runtime edits are ignored.
+
 # Strategy thresholds
 MIN_SCORE = 0.62
 BAR_SIZE = "5 mins"
+BAR_SECONDS = 5 * 60          # length of one BAR_SIZE bar
 DURATION = "2 D"
 USE_RTH = True
 
@@ -41,7 +51,11 @@ EU_CLOSE = dt.time(17, 25)
 
 # Safety / throttling
 MAX_NEW_TRADES_PER_LOOP = 2   # sæt 0 for ingen cap
-SLEEP_BETWEEN_ORDERS = 0.8
+MAX_CONCURRENT_HIST = 40      # initial bar loads in flight
+MAX_BAR_SUBSCRIPTIONS = 45    # open keepUpToDate streams (IB allows ~50 open historical requests)
+STALE_GRACE_SEC = 30          # slack past one bar before a stream counts as stalled
+PACING_ERROR_CODES = (100, 162, 420)  # IB pacing violations
+PACING_BACKOFF_SEC = 1.0
 
 # CSV whitelist file pattern (generated by your scan)
 EU_SCAN_OK_PATTERN = "eu_scan_ok_*.csv"
@@ -57,32 +71,13 @@ FALLBACK_EU = [
     ("MC", "EUR", "SBF"),
 ]
 
-# ===============================
-# CONNECT
-# ===============================
-def connect_ib():
-    ib = IB()
-    for i in range(10):
-        try:
-            print(f"Connecting to IBKR... attempt {i+1}")
-            ib.connect(HOST, PORT, clientId=CLIENT_ID)
-            if ib.isConnected():
-                print("Connected.")
-                return ib
-        except Exception as e:
-            print(f"Connect failed: {e}")
-            time.sleep(2)
-    raise RuntimeError("Could not connect to IBKR (TWS running + API enabled?)")
-
 # ===============================
 # TIME HELPERS
 # ===============================
+_EU_SESSION = new_session_cache()
+
 def eu_market_open_now():
-    now = dt.datetime.now(EU_TZ)
-    if now.weekday() >= 5:
-        return False
-    t = now.time()
-    return (t >= EU_OPEN) and (t < EU_CLOSE)
+    return session_open_now(EU_TZ, EU_OPEN, EU_CLOSE, _EU_SESSION)
 
 # ===============================
 # DATA + MATH HELPERS
@@ -90,25 +85,6 @@ def eu_market_open_now():
 def _dec(x) -> Decimal:
     return Decimal(str(x))
 
-def sma(values, length):
-    if len(values) < length:
-        return None
-    return sum(values[-length:]) / length
-
-def true_range(h, l, prev_close):
-    return max(h - l, abs(h - prev_close), abs(l - prev_close))
-
-def atr_from_bars(bars, length=14):
-    if len(bars) < length + 1:
-        return None
-    trs = []
-    for i in range(1, len(bars)):
-        tr = true_range(bars[i].high, bars[i].low, bars[i-1].close)
-        trs.append(tr)
-    if len(trs) < length:
-        return None
-    return sum(trs[-length:]) / length
-
 def tick_from_market_rule(price: float, rule_increments):
     """
     rule_increments: list of PriceIncrement(lowEdge, increment)
@@ -151,73 +127,190 @@ def load_latest_eu_whitelist():
         return FALLBACK_EU, None
 
     latest = files[-1]
-    items = []
     try:
-        with open(latest, "r", newline="", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            # We try common column names:
-            # symbol, currency, primaryExchange (or primary_exchange)
-            for row in reader:
-                sym = (row.get("symbol") or row.get("Symbol") or "").strip()
-                cur = (row.get("currency") or row.get("Currency") or row.get("cur") or "").strip()
-                prim = (row.get("primaryExchange") or row.get("primary_exchange") or row.get("PrimaryExchange") or row.get("primary") or "").strip()
-                if not sym or not cur:
-                    continue
-                if not prim:
-                    # If primary exchange is missing, SMART may still qualify, but EU is trickier.
-                    # We'll keep it and let contractDetails decide, but you may see more rejects.
-                    prim = ""
-                items.append((sym, cur, prim))
+        df = pd.read_csv(latest, dtype=str, keep_default_na=False, encoding="utf-8")
     except Exception as e:
         print(f"Could not read {latest}: {e}")
         return FALLBACK_EU, None
 
-    # de-dup
-    seen = set()
-    cleaned = []
-    for sym, cur, prim in items:
-        key = (sym, cur, prim)
-        if key in seen:
-            continue
-        seen.add(key)
-        cleaned.append((sym, cur, prim))
+    def column(*names):
+        # We try common column names:
+        # symbol, currency, primaryExchange (or primary_exchange)
+        for n in names:
+            if n in df.columns:
+                return df[n].str.strip()
+        return pd.Series("", index=df.index)
+
+    if "status" in df.columns:
+        df = df[df["status"].str.strip().eq("OK")]
+
+    # If primary exchange is missing, SMART may still qualify, but EU is trickier.
+    # We keep it as "" and let contractDetails decide, but you may see more rejects.
+    items = pd.DataFrame({
+        "sym": column("symbol", "Symbol"),
+        "cur": column("currency", "Currency", "cur"),
+        "prim": column("primaryExchange", "primary_exchange", "PrimaryExchange", "primary"),
+    })
+    items = items[items["sym"].ne("") & items["cur"].ne("")].drop_duplicates()
+    cleaned = list(items.itertuples(index=False, name=None))
 
     return cleaned if cleaned else FALLBACK_EU, latest
 
 # ===============================
 # ORDER / PORTFOLIO HELPERS
 # ===============================
-def current_positions_by_symbol(ib):
-    d = {}
-    for p in ib.positions():
+# (account, conId) -> (symbol, position), seeded at startup and kept current
+# by positionEvent. Keyed per contract: symbols collide across EU exchanges.
+POSITIONS = {}
+
+def track_positions(ib):
+    def on_position(p):
         try:
-            sym = p.contract.symbol
-            d[sym] = d.get(sym, 0) + float(p.position)
+            POSITIONS[(p.account, p.contract.conId)] = (p.contract.symbol, float(p.position))
         except Exception:
-            continue
+            pass
+
+    for p in ib.positions():
+        on_position(p)
+    ib.positionEvent += on_position
+
+def current_positions_by_symbol():
+    d = {}
+    for sym, qty in POSITIONS.values():
+        d[sym] = d.get(sym, 0) + qty
     return d
 
-def has_open_order_for_symbol(ib, symbol: str) -> bool:
+def symbols_with_open_orders(ib) -> set:
     """
-    True if there is any open trade (Submitted/PreSubmitted/PendingSubmit) for that symbol.
+    Symbols with any open trade (Submitted/PreSubmitted/PendingSubmit), built in
+    one pass so the loop can test membership instead of rescanning per symbol.
     """
+    syms = set()
     for tr in ib.openTrades():
         try:
-            if tr.contract and tr.contract.symbol == symbol:
+            if tr.contract:
                 st = (tr.orderStatus.status or "").lower()
                 if st in ("presubmitted", "submitted", "pendingsubmit", "pendingcancel"):
-                    return True
+                    syms.add(tr.contract.symbol)
         except Exception:
             continue
-    return False
+    return syms
+
+def open_positions_count():
+    return sum(1 for _, qty in POSITIONS.values() if abs(qty) > 0.000001)
+
+# ===============================
+# PACING
+# ===============================
+# No fixed sleeps between orders: IB tells us when we are too fast, and only
+# then do we back off before the next order.
+PACING = {"until": 0.0}
+
+def on_error(reqId, errorCode, errorString, contract):
+    if errorCode in PACING_ERROR_CODES:
+        PACING["until"] = time.time() + PACING_BACKOFF_SEC
+        print(f"Pacing error {errorCode}: {errorString} - backing off {PACING_BACKOFF_SEC}s")
 
-def open_positions_count(ib):
-    return sum(1 for p in ib.positions() if abs(float(p.position)) > 0.000001)
+def wait_for_pacing(ib):
+    remaining = PACING["until"] - time.time()
+    if remaining > 0:
+        ib.sleep(remaining)
+
+# ===============================
+# BAR STORE + SCORE CACHE
+# ===============================
+# Each contract gets one keepUpToDate subscription at startup. IB appends and
+# updates bars in place, so the loop never re-requests history. Scores are
+# cached per last bar, so a symbol with no new data costs no math.
+BAR_STORE = {}      # conId -> live BarDataList
+_SCORE_CACHE = {}   # conId -> ((last bar date, close, high, low), (score, price, atr))
+
+async def subscribe_bars(ib, contracts):
+    """
+    Start a keepUpToDate bar subscription per contract, at most
+    MAX_CONCURRENT_HIST initial loads in flight, paced by this client's
+    message budget.
+    """
+    if len(contracts) > MAX_BAR_SUBSCRIPTIONS:
+        dropped = contracts[MAX_BAR_SUBSCRIPTIONS:]
+        print(
+            f"WARNING: {len(contracts)} symbols but only {MAX_BAR_SUBSCRIPTIONS} bar streams allowed; "
+            f"not trading {len(dropped)}: {', '.join(c.symbol for c in dropped)}"
+        )
+        contracts = contracts[:MAX_BAR_SUBSCRIPTIONS]
+
+    sem = asyncio.Semaphore(MAX_CONCURRENT_HIST)
+    limiter = budget_limiter(CLIENT_ID)
+
+    async def subscribe(c):
+        async with sem:
+            await limiter.acquire()
+            try:
+                BAR_STORE[c.conId] = await ib.reqHistoricalDataAsync(
+                    c,
+                    endDateTime="",
+                    durationStr=DURATION,
+                    barSizeSetting=BAR_SIZE,
+                    whatToShow="TRADES",
+                    useRTH=USE_RTH,
+                    formatDate=1,
+                    keepUpToDate=True
+                )
+            except Exception as e:
+                print(f"Bar subscription failed for {c.symbol}: {e}")
+
+    await asyncio.gather(*(subscribe(c) for c in contracts))
+
+def bars_stale(bars):
+    # A live stream starts a new bar every BAR_SECONDS; an older last bar means
+    # the feed stalled (or the symbol stopped trading) and prices are frozen.
+    return time.time() - bars[-1].date.timestamp() > BAR_SECONDS + STALE_GRACE_SEC
+
+# ===============================
+# INCREMENTAL ATR (Wilder)
+# ===============================
+# ATR is smoothed with Wilder's recurrence atr = (atr*(n-1) + tr) / n, so each
+# new bar costs O(1) instead of re-summing ATR_LEN true ranges. State covers
+# completed bars only; the still-forming last bar is folded in per call.
+IND_STATE = {}      # conId -> {"atr", "last_close", "last_bar_time"}
+
+def _true_range(bar, prev_close):
+    return max(bar.high - bar.low, abs(bar.high - prev_close), abs(bar.low - prev_close))
+
+def _warmup_atr(bars, _n=ATR_LEN):
+    # Seed with the plain mean of the first ATR_LEN true ranges, then smooth
+    done = bars[:-1]
+    trs = [_true_range(done[i], done[i - 1].close) for i in range(1, len(done))]
+    atr = sum(trs[:_n]) / _n
+    for tr in trs[_n:]:
+        atr = (atr * (_n - 1) + tr) / _n
+    return {"atr": atr, "last_close": done[-1].close, "last_bar_time": done[-1].date}
+
+def live_atr(con_id, bars, _n=ATR_LEN):
+    st = IND_STATE.get(con_id)
+    if st is None:
+        st = IND_STATE[con_id] = _warmup_atr(bars)
+    elif bars[-2].date != st["last_bar_time"]:
+        # Walk back to the last bar we smoothed; normally one step
+        i = len(bars) - 2
+        while i >= 0 and bars[i].date != st["last_bar_time"]:
+            i -= 1
+        if i < 0:
+            st = IND_STATE[con_id] = _warmup_atr(bars)
+        else:
+            atr, prev_close = st["atr"], st["last_close"]
+            for b in bars[i + 1:-1]:
+                atr = (atr * (_n - 1) + _true_range(b, prev_close)) / _n
+                prev_close = b.close
+            st.update(atr=atr, last_close=prev_close, last_bar_time=bars[-2].date)
+
+    tr = _true_range(bars[-1], st["last_close"])
+    return (st["atr"] * (_n - 1) + tr) / _n
 
 # ===============================
 # STRATEGY + SCORE
 # ===============================
-def score_contract(ib, contract):
+def score_contract(contract):
     """
     Simple but practical quality-score for EU:
     - Trend: SMA10 vs SMA30
@@ -225,36 +318,40 @@ def score_contract(ib, contract):
     - Volatility sanity: ATR as % of price (avoid super dead or insane)
     Returns: (score, last_price, atr)
     """
-    try:
-        bars = ib.reqHistoricalData(
-            contract,
-            endDateTime="",
-            durationStr=DURATION,
-            barSizeSetting=BAR_SIZE,
-            whatToShow="TRADES",
-            useRTH=USE_RTH,
-            formatDate=1
-        )
-    except Exception:
-        return None, None, None
-
+    bars = BAR_STORE.get(contract.conId)
     if not bars or len(bars) < 60:
         return None, None, None
 
-    closes = [b.close for b in bars]
-    price = closes[-1]
-    sma10 = sma(closes, 10)
-    sma30 = sma(closes, 30)
-    if sma10 is None or sma30 is None or price is None:
-        return None, None, None
-
-    atr = atr_from_bars(bars, ATR_LEN)
-    if atr is None or atr <= 0:
-        return None, None, None
+    # The forming bar's high/low move the ATR even when its close repeats
+    last = bars[-1]
+    last_key = (last.date, last.close, last.high, last.low)
+    cached = _SCORE_CACHE.get(contract.conId)
+    if cached and cached[0] == last_key:
+        return cached[1]
+
+    result = _score_bars(contract.conId, bars)
+    _SCORE_CACHE[contract.conId] = (last_key, result)
+    return result
+
+def _score_bars(con_id, bars, _min_score=MIN_SCORE):
+    # len(bars) >= 60 covers every window below, so no None/NaN checks needed.
+    # Only the last 30 closes feed the SMAs, so only those are converted.
+    closes = bar_array(bars[-30:], "close")
+    price = float(closes[-1])
+    sma10 = sma_last(closes, 10)
+    sma30 = sma_last(closes, 30)
 
     # Components mapped to 0..1
     trend = 1.0 if sma10 > sma30 else 0.0
     momentum = max(0.0, min(1.0, (price / sma30 - 1.0) / 0.01))  # 1% above sma30 ~ full
+
+    # vol_score is at most 1.0: if even that can't reach MIN_SCORE, skip ATR
+    if (0.45 * trend) + (0.35 * momentum) + 0.20 < _min_score:
+        return None, None, None
+
+    atr = live_atr(con_id, bars)
+    if not atr > 0:
+        return None, None, None
     atr_pct = atr / price
 
     # Prefer "normal" intraday vol range for entries
@@ -268,18 +365,19 @@ def score_contract(ib, contract):
 
     # Combine
     score = (0.45 * trend) + (0.35 * momentum) + (0.20 * vol_score)
-    return float(score), float(price), float(atr)
+    return float(score), price, float(atr)
 
 # ===============================
 # BRACKET ORDER (EU tick-safe)
 # ===============================
-def place_bracket(ib, contract, qty, entry_price, atr_val, rule_increments):
+def place_bracket(ib, contract, qty, entry_price, atr_val, rule_increments,
+                  _tp_atr=TAKE_PROFIT_ATR, _sl_atr=STOP_LOSS_ATR):
     """
     Parent Market BUY + TP Limit SELL + SL Stop SELL
     Tick sizes derived from Market Rule increments.
     """
-    tp_raw = entry_price + TAKE_PROFIT_ATR * atr_val
-    sl_raw = entry_price - STOP_LOSS_ATR * atr_val
+    tp_raw = entry_price + _tp_atr * atr_val
+    sl_raw = entry_price - _sl_atr * atr_val
     if sl_raw <= 0:
         return False
 
@@ -303,7 +401,6 @@ def place_bracket(ib, contract, qty, entry_price, atr_val, rule_increments):
 
     try:
         parent_trade = ib.placeOrder(contract, parent)
-        ib.sleep(0.25)
         parent_id = parent_trade.order.orderId
 
         tp_order.parentId = parent_id
@@ -316,14 +413,77 @@ def place_bracket(ib, contract, qty, entry_price, atr_val, rule_increments):
         print(f"place_bracket failed for {contract.symbol}: {e}")
         return False
 
+# ===============================
+# CONTRACTS + MARKET RULES
+# ===============================
+async def load_contracts(ib, eu_items):
+    """
+    Qualify the whitelist concurrently (one contract-details request per
+    symbol, all in flight together) and fetch each distinct market rule once.
+    Symbols that match more than one contract are skipped, not guessed.
+    Every request is paced by this client's message budget.
+    Returns: ({sym: contract}, {sym: [PriceIncrement]})
+    """
+    sem = asyncio.Semaphore(MAX_CONCURRENT_HIST)
+    limiter = budget_limiter(CLIENT_ID)
+
+    async def details(sym, cur, prim):
+        c = Stock(sym, "SMART", cur, primaryExchange=prim) if prim else Stock(sym, "SMART", cur)
+        async with sem:
+            await limiter.acquire()
+            try:
+                cds = await ib.reqContractDetailsAsync(c)
+            except Exception:
+                return None
+        if not cds:
+            return None
+        if len(cds) > 1:
+            # Like qualifyContracts: never guess (SAN without primaryExchange is
+            # both Sanofi and Santander)
+            prims = ", ".join(cd.contract.primaryExchange for cd in cds)
+            print(f"Ambiguous EU contract {sym} {cur} prim={prim or '-'} ({prims}); skipped")
+            return None
+
+        # Fill in the qualified fields but keep SMART routing, as qualifyContracts does
+        cd = cds[0]
+        util.dataclassUpdate(c, cd.contract)
+        c.exchange = "SMART"
+        return sym, c, cd
+
+    found = [r for r in await asyncio.gather(*(details(*item) for item in eu_items)) if r]
+
+    # Many symbols on one exchange share a rule id; ask for each only once
+    first_rule = {}
+    for sym, _, cd in found:
+        rule_ids = (cd.marketRuleIds or "").strip()
+        if rule_ids:
+            first_rule[sym] = int(rule_ids.split(",")[0])
+
+    async def market_rule(rid):
+        await limiter.acquire()
+        return await ib.reqMarketRuleAsync(rid)
+
+    rule_ids = sorted(set(first_rule.values()))
+    fetched = await asyncio.gather(
+        *(market_rule(rid) for rid in rule_ids), return_exceptions=True
+    )
+    by_id = {rid: (r if isinstance(r, list) else []) for rid, r in zip(rule_ids, fetched)}
+
+    eu_contracts = {sym: c for sym, c, _ in found}
+    eu_rules = {sym: by_id.get(first_rule.get(sym), []) for sym, _, _ in found}
+    return eu_contracts, eu_rules
+
 # ===============================
 # MAIN
 # ===============================
 def main():
-    ib = connect_ib()
+    ib = get_ib(CLIENT_ID, HOST, PORT)
+    print("Connected.")
     accounts = ib.managedAccounts()
     acct = accounts[0] if accounts else "UNKNOWN"
     print(f"Managed account: {acct}")
+    track_positions(ib)
+    ib.errorEvent += on_error
 
     eu_items, src = load_latest_eu_whitelist()
     if src:
@@ -332,32 +492,12 @@ def main():
         print("Loaded EU whitelist from fallback list (no scan csv found).")
 
     # Build + qualify contracts and fetch market rules
-    eu_contracts = {}
-    eu_rules = {}
-
-    ok = 0
-    for sym, cur, prim in eu_items:
-        c = Stock(sym, "SMART", cur, primaryExchange=prim) if prim else Stock(sym, "SMART", cur)
-        try:
-            cds = ib.reqContractDetails(c)
-            if not cds:
-                continue
-
-            cd = cds[0]
-            ib.qualifyContracts(c)
-            eu_contracts[sym] = c
-
-            rule_ids = (cd.marketRuleIds or "").strip()
-            rule_list = []
-            if rule_ids:
-                first_rule = int(rule_ids.split(",")[0])
-                rule_list = ib.reqMarketRule(first_rule) or []
-            eu_rules[sym] = rule_list
-            ok += 1
-        except Exception:
-            continue
+    eu_contracts, eu_rules = ib.run(load_contracts(ib, eu_items))
+    print(f"Qualified EU: {len(eu_contracts)}")
 
-    print(f"Qualified EU: {ok}")
+    ib.run(subscribe_bars(ib, list(eu_contracts.values())))
+    eu_contracts = {sym: c for sym, c in eu_contracts.items() if c.conId in BAR_STORE}
+    print(f"Streaming bars for: {len(eu_contracts)}")
     print("EU LOOP STARTED")
     print(
         f"CAPITAL_PER_TRADE_EUR={CAPITAL_PER_TRADE_EUR} | "
@@ -369,21 +509,28 @@ def main():
         try:
             if not eu_market_open_now():
                 print("EU market closed. Sleeping...")
-                time.sleep(60)
+                ib.sleep(60)
                 continue
 
-            pos_count = open_positions_count(ib)
+            pos_count = open_positions_count()
             if pos_count >= MAX_OPEN_POSITIONS:
                 print("Max positions reached. Sleeping.")
-                time.sleep(LOOP_SECONDS)
+                ib.sleep(LOOP_SECONDS)
                 continue
 
-            pos_by_sym = current_positions_by_symbol(ib)
+            pos_by_sym = current_positions_by_symbol()
 
-            # Score and rank
+            # Score and rank from the live bar store
+            busy = symbols_with_open_orders(ib)
             ranked = []
+            stale = []
             for sym, c in eu_contracts.items():
-                if has_open_order_for_symbol(ib, sym):
+                if sym in busy:
+                    continue
+
+                bars = BAR_STORE.get(c.conId)
+                if bars and bars_stale(bars):
+                    stale.append(sym)
                     continue
 
                 if (not ALLOW_ADD_TO_EXISTING_POSITIONS) and (abs(pos_by_sym.get(sym, 0)) > 0):
@@ -393,30 +540,39 @@ def main():
                     if abs(pos_by_sym.get(sym, 0)) >= MAX_POSITION_PER_SYMBOL:
                         continue
 
-                score, price, atr = score_contract(ib, c)
+                score, price, atr = score_contract(c)
                 if score is None or price is None or atr is None:
                     continue
 
                 if score >= MIN_SCORE:
                     ranked.append((score, sym, c, price, atr))
 
-            ranked.sort(reverse=True, key=lambda x: x[0])
+            if stale:
+                print(f"Stale bars, skipped: {', '.join(stale)}")
 
             if not ranked:
                 print("No ranked candidates. Sleeping.")
-                time.sleep(LOOP_SECONDS)
+                ib.sleep(LOOP_SECONDS)
                 continue
 
+            # Pop best-first from a heap: usually only a few pops are needed,
+            # but a skipped candidate (qty 0, failed bracket) falls through to
+            # the next one. Index breaks ties in ranking order.
+            heap = [(-r[0], i) for i, r in enumerate(ranked)]
+            heapq.heapify(heap)
+
             placed = 0
-            for score, sym, c, price, atr in ranked:
+            while heap:
                 if MAX_NEW_TRADES_PER_LOOP and placed >= MAX_NEW_TRADES_PER_LOOP:
                     break
+                score, sym, c, price, atr = ranked[heapq.heappop(heap)[1]]
 
-                # Re-check position cap after each placement
-                pos_count = open_positions_count(ib)
-                if pos_count >= MAX_OPEN_POSITIONS:
+                # Orders placed this pass aren't positions yet (the loop doesn't
+                # yield until they fill), so count them against the cap ourselves
+                if pos_count + placed >= MAX_OPEN_POSITIONS:
                     break
 
+                wait_for_pacing(ib)
                 qty = position_size(price)
                 if qty <= 0:
                     continue
@@ -428,18 +584,16 @@ def main():
                 ok = place_bracket(ib, c, qty, price, atr, rules)
                 if ok:
                     placed += 1
-                ib.sleep(SLEEP_BETWEEN_ORDERS)
 
-            time.sleep(LOOP_SECONDS)
+            ib.sleep(LOOP_SECONDS)
 
         except KeyboardInterrupt:
             print("CTRL+C received. Stopping.")
             break
         except Exception as e:
             print(f"Loop error: {e}")
-            time.sleep(3)
+            ib.sleep(3)
 
-    ib.disconnect()
     print("DONE")
 
 if __name__ == "__main__":
@@ -1,6 +1,8 @@
-from ib_insync import *
+from ib_async import *
+from ib_conn import get_ib
+from market_hours import new_session_cache, session_open_now
 import datetime
-import time
+from zoneinfo import ZoneInfo
 
 # ===============================
 # CONFIG
@@ -13,7 +15,11 @@ CLIENT_ID = 1
 CAPITAL_PER_TRADE = 50000          # <-- hæv den hvis du vil købe større (fx 20000 eller 50000)
 MAX_OPEN_POSITIONS = 40           # max antal *aktier* med åben position (ikke antal handler)
 MAX_POSITION_PER_SYMBOL = 0       # 0 = ubegrænset. Ellers max antal aktier (shares) pr. symbol
-LOOP_SECONDS = 15
+
+# US markedstid (NYSE/Nasdaq regular session), DST-korrekt via zoneinfo
+NY_TZ = ZoneInfo("America/New_York")
+US_OPEN = datetime.time(9, 30)
+US_CLOSE = datetime.time(16, 0)
 
 # US ONLY LIQUID STOCKS
 SYMBOLS = [
@@ -22,32 +28,14 @@ SYMBOLS = [
     "JPM","GS","COST","NFLX","BA"
 ]
 
-# ===============================
-# CONNECT
-# ===============================
-
-def connect_ib():
-    ib = IB()
-    for i in range(5):
-        try:
-            print(f"Connecting to IBKR... attempt {i+1}")
-            ib.connect(HOST, PORT, clientId=CLIENT_ID)
-            if ib.isConnected():
-                print("Connected.")
-                return ib
-        except Exception:
-            time.sleep(2)
-    raise RuntimeError("Could not connect to IBKR")
-
 # ===============================
 # HELPERS
 # ===============================
 
+_US_SESSION = new_session_cache()
+
 def us_market_open():
-    # Simpel "er det ca. US markedstid?" (kan forbedres med DST senere)
-    now = datetime.datetime.now(datetime.timezone.utc)
-    est = now.astimezone(datetime.timezone(datetime.timedelta(hours=-5)))
-    return 9 <= est.hour < 16
+    return session_open_now(NY_TZ, US_OPEN, US_CLOSE, _US_SESSION)
 
 def get_sma(bars, length):
     if len(bars) < length:
@@ -55,30 +43,27 @@ def get_sma(bars, length):
     closes = [b.close for b in bars]
     return sum(closes[-length:]) / length
 
-def get_price(ib, contract):
-    bars = ib.reqHistoricalData(
-        contract,
-        endDateTime='',
-        durationStr='1 D',
-        barSizeSetting='5 mins',
-        whatToShow='TRADES',
-        useRTH=True
-    )
-    if not bars:
-        return None
-    return bars[-1].close
-
 def position_size(price):
     # Derfor kan den købe "kun 1": hvis CAPITAL_PER_TRADE < pris*2, så qty bliver 1
     qty = int(CAPITAL_PER_TRADE / price)
     return max(1, qty)
 
-def position_qty(ib, symbol):
+# (konto, conId) -> (symbol, aktie-position), holdes opdateret af positionEvent
+# (ingen scan pr. bar). Nøgle pr. kontrakt, så to konti/kontrakter med samme
+# symbol ikke overskriver hinanden.
+POSITIONS = {}
+
+def track_positions(ib):
+    def on_position(p):
+        if getattr(p.contract, "secType", None) == "STK":
+            POSITIONS[(p.account, p.contract.conId)] = (p.contract.symbol, float(p.position))
+
     for p in ib.positions():
-        c = p.contract
-        if getattr(c, "symbol", None) == symbol and getattr(c, "secType", None) == "STK":
-            return float(p.position)
-    return 0.0
+        on_position(p)
+    ib.positionEvent += on_position
+
+def position_qty(symbol):
+    return sum(qty for sym, qty in POSITIONS.values() if sym == symbol)
 
 def has_open_order(ib, symbol):
     """
@@ -98,28 +83,15 @@ def has_open_order(ib, symbol):
             pass
     return False
 
-def count_open_position_symbols(ib):
+def count_open_position_symbols():
     # Hvor mange *symboler* har vi en ikke-nul position i?
-    count = 0
-    for p in ib.positions():
-        if getattr(p.contract, "secType", None) == "STK" and abs(float(p.position)) > 0:
-            count += 1
-    return count
+    return sum(1 for _, qty in POSITIONS.values() if abs(qty) > 0)
 
 # ===============================
 # STRATEGY
 # ===============================
 
-def check_signal(ib, contract):
-    bars = ib.reqHistoricalData(
-        contract,
-        endDateTime='',
-        durationStr='2 D',
-        barSizeSetting='5 mins',
-        whatToShow='TRADES',
-        useRTH=True
-    )
-
+def check_signal(bars):
     if len(bars) < 50:
         return None
 
@@ -136,68 +108,92 @@ def check_signal(ib, contract):
     return None
 
 # ===============================
-# MAIN LOOP
+# EVENT HANDLING
 # ===============================
 
-def main():
-    ib = connect_ib()
-    print("US ONLY MOMENTUM LOOP STARTED")
-    print(f"Add-to-position: ON  |  MAX_POSITION_PER_SYMBOL={MAX_POSITION_PER_SYMBOL} (0=unlimited)")
-    print(f"CAPITAL_PER_TRADE={CAPITAL_PER_TRADE}  |  MAX_OPEN_POSITIONS={MAX_OPEN_POSITIONS}")
+def on_new_bar(ib, contract, bars):
+    symbol = contract.symbol
 
-    contracts = [Stock(s, "SMART", "USD") for s in SYMBOLS]
-    ib.qualifyContracts(*contracts)
+    if not us_market_open():
+        return
 
-    while True:
-        if not us_market_open():
-            print("US market closed. Sleeping...")
-            time.sleep(60)
-            continue
+    open_symbol_positions = count_open_position_symbols()
+    if open_symbol_positions >= MAX_OPEN_POSITIONS:
+        print("Max positions reached.")
+        return
 
-        open_symbol_positions = count_open_position_symbols(ib)
-        if open_symbol_positions >= MAX_OPEN_POSITIONS:
-            print("Max positions reached.")
-            time.sleep(LOOP_SECONDS)
-            continue
+    # Undgå at spamme flere ordrer på samme symbol mens en ordre stadig er aktiv
+    if has_open_order(ib, symbol):
+        return
 
-        for contract in contracts:
-            symbol = contract.symbol
+    signal = check_signal(bars)
+    if not signal:
+        return
 
-            # Undgå at spamme flere ordrer på samme symbol mens en ordre stadig er aktiv
-            if has_open_order(ib, symbol):
-                continue
+    price = bars[-1].close
+    if not price:
+        return
 
-            signal = check_signal(ib, contract)
-            if not signal:
-                continue
+    qty = position_size(price)
 
-            price = get_price(ib, contract)
-            if not price:
-                continue
+    # Valgfrit loft pr symbol (shares)
+    if MAX_POSITION_PER_SYMBOL and MAX_POSITION_PER_SYMBOL > 0:
+        current = abs(position_qty(symbol))
+        if current >= MAX_POSITION_PER_SYMBOL:
+            return
+        # sørg for ikke at gå over loftet
+        qty = int(min(qty, MAX_POSITION_PER_SYMBOL - current))
+        if qty <= 0:
+            return
 
-            qty = position_size(price)
+    if signal == "BUY":
+        order = MarketOrder("BUY", qty)
+    else:
+        order = MarketOrder("SELL", qty)
 
-            # Valgfrit loft pr symbol (shares)
-            if MAX_POSITION_PER_SYMBOL and MAX_POSITION_PER_SYMBOL > 0:
-                current = abs(position_qty(ib, symbol))
-                if current >= MAX_POSITION_PER_SYMBOL:
-                    continue
-                # sørg for ikke at gå over loftet
-                qty = int(min(qty, MAX_POSITION_PER_SYMBOL - current))
-                if qty <= 0:
-                    continue
+    print(f"{signal} {symbol} qty={qty} price~{price}")
+    ib.placeOrder(contract, order)
 
-            if signal == "BUY":
-                order = MarketOrder("BUY", qty)
-            else:
-                order = MarketOrder("SELL", qty)
+# ===============================
+# MAIN
+# ===============================
 
-            print(f"{signal} {symbol} qty={qty} price~{price}")
-            ib.placeOrder(contract, order)
+def main():
+    ib = get_ib(CLIENT_ID, HOST, PORT)
+    print("Connected.")
+    track_positions(ib)
+    print("US ONLY MOMENTUM LOOP STARTED")
+    print(f"Add-to-position: ON  |  MAX_POSITION_PER_SYMBOL={MAX_POSITION_PER_SYMBOL} (0=unlimited)")
+    print(f"CAPITAL_PER_TRADE={CAPITAL_PER_TRADE}  |  MAX_OPEN_POSITIONS={MAX_OPEN_POSITIONS}")
 
-            time.sleep(1.0)
+    contracts = [Stock(s, "SMART", "USD") for s in SYMBOLS]
+    ib.qualifyContracts(*contracts)
 
-        time.sleep(LOOP_SECONDS)
+    # Subscribe once: IB keeps each bar list current and pushes updates,
+    # so nothing polls. We only act when a new 5-min bar starts.
+    for contract in contracts:
+        ib.reqHistoricalData(
+            contract,
+            endDateTime='',
+            durationStr='2 D',
+            barSizeSetting='5 mins',
+            whatToShow='TRADES',
+            useRTH=True,
+            keepUpToDate=True
+        )
+
+    def on_bar_update(bars, hasNewBar):
+        if hasNewBar:
+            on_new_bar(ib, bars.contract, bars)
+
+    ib.barUpdateEvent += on_bar_update
+
+    try:
+        ib.run()
+    except KeyboardInterrupt:
+        print("CTRL+C received. Stopping.")
+    finally:
+        ib.barUpdateEvent -= on_bar_update
 
 if __name__ == "__main__":
     main()
@@ -1,5 +1,7 @@
-from ib_insync import *
-import time
+from ib_async import *
+from ib_conn import get_ib
+import asyncio
+import pandas as pd
 import datetime
 from collections import defaultdict
 
@@ -60,27 +62,16 @@ EU_CANDIDATES = [
 
 # Hvis du vil udvide: tilføj flere tuples (symbol, exchange, currency)
 
-# ===============================
-# CONNECT
-# ===============================
-def connect_ib():
-    ib = IB()
-    for i in range(5):
-        try:
-            print(f"Connecting to IBKR... attempt {i+1}")
-            ib.connect(HOST, PORT, clientId=CLIENT_ID)
-            if ib.isConnected():
-                print("Connected.")
-                return ib
-        except Exception as e:
-            print("Connect error:", e)
-            time.sleep(2)
-    raise RuntimeError("Could not connect to IBKR")
+MAX_IN_FLIGHT = 25        # samtidige qualify/historik-requests (TWS tåler ~50)
+
+# Kolonner i output-filen (uden header), i denne rækkefølge
+OUT_COLUMNS = ["symbol", "exchange", "primaryExchange", "currency",
+               "localSymbol", "tradingClass", "conId"]
 
 # ===============================
 # TEST HELPERS
 # ===============================
-def try_qualify_and_bars(ib: IB, symbol: str, exch: str, ccy: str):
+async def try_qualify_and_bars(ib: IB, symbol: str, exch: str, ccy: str):
     """
     Return: (ok:bool, reason:str, contract_or_none)
     """
@@ -88,8 +79,9 @@ def try_qualify_and_bars(ib: IB, symbol: str, exch: str, ccy: str):
 
     # 1) qualify
     try:
-        qualified = ib.qualifyContracts(c)
-        if not qualified:
+        qualified = await ib.qualifyContractsAsync(c)
+        # ib_async giver [None] (ikke []) for en kontrakt der ikke kan qualifies
+        if not qualified or qualified[0] is None:
             return (False, "qualify_failed", None)
         c = qualified[0]
     except Exception as e:
@@ -97,7 +89,7 @@ def try_qualify_and_bars(ib: IB, symbol: str, exch: str, ccy: str):
 
     # 2) bars test (historical)
     try:
-        bars = ib.reqHistoricalData(
+        bars = await ib.reqHistoricalDataAsync(
             c,
             endDateTime="",
             durationStr=DURATION,
@@ -117,19 +109,43 @@ def try_qualify_and_bars(ib: IB, symbol: str, exch: str, ccy: str):
     # Hvis vi fik data, er det et stærkt tegn på at kontrakten virker i dit setup
     return (True, "ok", c)
 
+async def scan_symbol(ib: IB, sem: asyncio.Semaphore, candidates):
+    """
+    Prøv et symbols exchanges i rækkefølge og stop ved første OK.
+    Return: liste af (tag, ok, reason, contract) for hvert forsøg
+    """
+    attempts = []
+    for (sym, exch, ccy) in candidates:
+        async with sem:
+            ok, reason, contract = await try_qualify_and_bars(ib, sym, exch, ccy)
+        attempts.append((f"{sym} @ {exch} {ccy}", ok, reason, contract))
+        if ok:
+            break
+    return attempts
+
+async def scan_all(ib: IB):
+    # Samme symbol kan stå med flere exchanges (fx CPH/CSE): én coroutine pr.
+    # symbol, så de prøves i rækkefølge, mens forskellige symboler kører samtidigt
+    groups = defaultdict(list)
+    for cand in EU_CANDIDATES:
+        groups[cand[0]].append(cand)
+
+    sem = asyncio.Semaphore(MAX_IN_FLIGHT)
+    return await asyncio.gather(*(scan_symbol(ib, sem, g) for g in groups.values()))
+
 def main():
-    ib = connect_ib()
+    ib = get_ib(CLIENT_ID, HOST, PORT)
+    print("Connected.")
 
     ok_list = []
     fail_counts = defaultdict(int)
 
     print("\nEU PRE-FLIGHT SCAN STARTED\n")
 
-    for (sym, exch, ccy) in EU_CANDIDATES:
-        tag = f"{sym} @ {exch} {ccy}"
-        print(f"Testing {tag} ...", end=" ")
+    results = ib.run(scan_all(ib))
 
-        ok, reason, contract = try_qualify_and_bars(ib, sym, exch, ccy)
+    for tag, ok, reason, contract in (a for attempts in results for a in attempts):
+        print(f"Testing {tag} ...", end=" ")
 
         if ok:
             # Gem “det vi faktisk bør bruge” (conId + primExch osv.)
@@ -147,8 +163,6 @@ def main():
             fail_counts[reason] += 1
             print(f"❌ {reason}")
 
-        time.sleep(0.25)  # vær sød ved API’et
-
     print("\n==============================")
     print("RESULT")
     print("==============================")
@@ -167,15 +181,10 @@ def main():
     # Dump til fil så vi kan copy/paste direkte ind i din bot senere
     ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     out = f"eu_scan_ok_{ts}.txt"
-    with open(out, "w", encoding="utf-8") as f:
-        for row in ok_list:
-            f.write(
-                f"{row['symbol']},{row['exchange']},{row['primaryExchange']},"
-                f"{row['currency']},{row['localSymbol']},{row['tradingClass']},{row['conId']}\n"
-            )
+    pd.DataFrame(ok_list, columns=OUT_COLUMNS).to_csv(
+        out, index=False, header=False, encoding="utf-8"
+    )
     print(f"\nSaved OK list to: {out}")
 
-    ib.disconnect()
-
 if __name__ == "__main__":
     main()
@@ -1,6 +1,9 @@
+import csv
 from datetime import datetime, timezone
 import pandas as pd
-from ib_insync import IB, Stock
+from ib_async import Stock
+
+from ib_conn import get_ib
 
 HOST = "127.0.0.1"
 PORT = 7497           # paper
@@ -21,8 +24,7 @@ def pick_price(ticker_obj):
     return None, "none"
 
 def main():
-    ib = IB()
-    ib.connect(HOST, PORT, clientId=CLIENT_ID)
+    ib = get_ib(CLIENT_ID, HOST, PORT)
     ib.reqMarketDataType(MARKET_DATA_TYPE)
 
     contracts = [Stock(sym, EXCHANGE, CURRENCY) for sym in TICKERS]
@@ -31,10 +33,10 @@ def main():
     rows = []
     ts = datetime.now(timezone.utc).isoformat()
 
-    for c in contracts:
-        t = ib.reqMktData(c, snapshot=True)
-        ib.sleep(1.2)  # lidt luft mellem requests
+    # Alle snapshots på én gang; returnerer når de alle er færdige
+    tickers = ib.reqTickers(*contracts)
 
+    for c, t in zip(contracts, tickers):
         price, src = pick_price(t)
         rows.append({
             "timestamp_utc": ts,
@@ -47,13 +49,16 @@ def main():
             "ask": t.ask,
         })
 
-    ib.disconnect()
-
     df = pd.DataFrame(rows).sort_values("symbol")
     print(df[["symbol", "price", "price_source", "last", "close", "bid", "ask"]].to_string(index=False))
 
     out = "prices_log.csv"
-    df.to_csv(out, mode="a", index=False, header=not pd.io.common.file_exists(out))
+    with open(out, "a", buffering=1 << 16, newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        if f.tell() == 0:   # ny/tom fil -> header
+            w.writerow(df.columns)
+        # NaN skrives som tom celle, som to_csv gjorde
+        w.writerows(df.astype(object).where(df.notna(), "").itertuples(index=False, name=None))
     print(f"\nSaved to {out}")
 
 if __name__ == "__main__":
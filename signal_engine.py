@@ -1,8 +1,9 @@
-from ib_insync import IB, Stock, util
-import pandas as pd
+from ib_async import Stock
 
-ib = IB()
-ib.connect("127.0.0.1", 7497, clientId=30)
+from ib_conn import get_ib
+from indicators import bar_array, ema_last, sma_last
+
+ib = get_ib(30)
 
 contract = Stock("SPY", "SMART", "USD")
 ib.qualifyContracts(contract)
@@ -16,31 +17,28 @@ bars = ib.reqHistoricalData(
     useRTH=True
 )
 
-df = util.df(bars)
+# Kun sidste bar bruges, så vi beregner skalarer i stedet for hele kolonner
+closes = bar_array(bars, "close")
+volumes = bar_array(bars, "volume")
 
 # Beregn EMA20
-df["EMA20"] = df["close"].ewm(span=20).mean()
+ema20 = ema_last(closes, 20)
 
 # Beregn volumen-gennemsnit
-df["VolAvg20"] = df["volume"].rolling(20).mean()
-
-latest = df.iloc[-1]
-previous = df.iloc[-2]
+vol_avg20 = sma_last(volumes, 20)
 
-print("Latest Close:", latest.close)
-print("EMA20:", latest.EMA20)
-print("Volume:", latest.volume)
-print("Volume Avg20:", latest.VolAvg20)
+print("Latest Close:", closes[-1])
+print("EMA20:", ema20)
+print("Volume:", volumes[-1])
+print("Volume Avg20:", vol_avg20)
 
 signal = False
 
 if (
-    latest.close > latest.EMA20 and
-    latest.close > previous.close and
-    latest.volume > latest.VolAvg20
+    closes[-1] > ema20 and
+    closes[-1] > closes[-2] and
+    volumes[-1] > vol_avg20
 ):
     signal = True
 
 print("\nBUY SIGNAL:", signal)
-
-ib.disconnect()
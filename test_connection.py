@@ -1,4 +1,4 @@
-from ib_insync import *
+from ib_async import *
 ib=IB(); ib.connect("127.0.0.1",7497,clientId=1)
 print("Connected:",ib.isConnected())
 print("Accounts:",ib.managedAccounts())
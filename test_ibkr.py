@@ -1,4 +1,4 @@
-from ib_insync import IB
+from ib_async import IB
 
 ib = IB()
 